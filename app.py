@@ -3,7 +3,7 @@ import tkinter as tk
 from typing import Type
 
 from agent import Agent
-from graphics import PacmanGraphics
+from graphics import Graphics, PacmanGraphics
 from game import Direction, Game
 
 __all__ = ['Application']
@@ -40,7 +40,7 @@ class Application(tk.Frame):
             self.window.bind(f'<{key}>', self._handle_key_press)
 
         self.graphics = PacmanGraphics(
-            self,
+            Graphics(self),
             0.0 if frame_rate == 0 else 1.0 / float(frame_rate),
             Application.UNIT_SIZE,
             (self.game.map.width, self.game.map.height)
@@ -4,7 +4,7 @@ import random
 from typing import Type
 import agent
 
-__all__ = ['get_run_configuration', 'load_layout']
+__all__ = ['get_run_configuration', 'load_layout', 'load_agents']
 
 
 class Configuration:
@@ -14,7 +14,14 @@ class Configuration:
                  ghost: Type[agent.Agent],
                  n_games: int,
                  n_ghosts: int,
-                 frame_rate: float):
+                 frame_rate: float,
+                 record: str = None,
+                 queue: 'QueueConfiguration' = None,
+                 soak: 'SoakConfiguration' = None,
+                 text_graphics: bool = False,
+                 zoom: float = 1.0,
+                 frame_skip: int = 0,
+                 solve: bool = False):
 
         self.layout = layout
         self.pacman = pacman
@@ -22,6 +29,57 @@ class Configuration:
         self.n_games = n_games
         self.n_ghosts = n_ghosts
         self.frame_rate = frame_rate
+        self.record = record
+        self.queue = queue
+        self.soak = soak
+        self.text_graphics = text_graphics
+        self.zoom = zoom
+        self.frame_skip = frame_skip
+        self.solve = solve
+
+
+class QueueConfiguration:
+    def __init__(self,
+                 path: str,
+                 worker: bool,
+                 n_jobs: int,
+                 n_workers: int,
+                 lease: float,
+                 max_ticks: int,
+                 max_attempts: int,
+                 layout: str,
+                 agent_module: str,
+                 pacman: str,
+                 ghost: str,
+                 n_ghosts: int,
+                 n_games: int,
+                 seed: int):
+
+        self.path = path
+        self.worker = worker
+        self.n_jobs = n_jobs
+        self.n_workers = n_workers
+        self.lease = lease
+        self.max_ticks = max_ticks
+        self.max_attempts = max_attempts
+        self.layout = layout
+        self.agent_module = agent_module
+        self.pacman = pacman
+        self.ghost = ghost
+        self.n_ghosts = n_ghosts
+        self.n_games = n_games
+        self.seed = seed
+
+
+class SoakConfiguration:
+    def __init__(self,
+                 interval: int,
+                 max_memory_growth: float,
+                 max_latency_drift: float):
+
+        self.interval = interval
+        self.max_memory_growth = max_memory_growth
+        self.max_latency_drift = max_latency_drift
 
 
 def add_arguments(parser: argparse.ArgumentParser):
@@ -34,6 +92,54 @@ def add_arguments(parser: argparse.ArgumentParser):
     parser.add_argument('-s', '--seed', type=int, default=-1,
                         dest='seed',
                         help='Seed for random number generator')
+    parser.add_argument('-o', '--record', default=None,
+                        dest='record',
+                        help='Render every tick offscreen into a directory of PNG frames, or into GIFs if it ends in .gif')
+    parser.add_argument('--frame-skip', type=int, default=0,
+                        dest='frame_skip',
+                        help='Number of ticks skipped between frames drawn as text')
+    parser.add_argument('--solve', action='store_true',
+                        dest='solve',
+                        help='Search the optimal score and moves for pacman against deterministic ghosts (small layouts)')
+
+
+def add_queue_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--queue', default=None,
+                        dest='queue',
+                        help='Job queue database on a shared filesystem; runs as coordinator unless --worker is given')
+    parser.add_argument('--worker', action='store_true',
+                        dest='worker',
+                        help='Claim and run jobs from the queue instead of enqueuing them')
+    parser.add_argument('--jobs', type=int, default=1,
+                        dest='n_jobs',
+                        help='Number of jobs the coordinator splits the games into')
+    parser.add_argument('--workers', type=int, default=0,
+                        dest='n_workers',
+                        help='Number of local worker processes started by the coordinator')
+    parser.add_argument('--lease', type=float, default=60.0,
+                        dest='lease',
+                        help='Seconds a claimed job stays leased to a worker without renewal')
+    parser.add_argument('--max-ticks', type=int, default=0,
+                        dest='max_ticks',
+                        help='Stop queued games after this many ticks (0: unlimited)')
+    parser.add_argument('--max-attempts', type=int, default=3,
+                        dest='max_attempts',
+                        help='Mark a job as failed once its lease expired this many times')
+
+
+def add_soak_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--soak', action='store_true',
+                        dest='soak',
+                        help='Track memory and tick latency across games and fail if they drift')
+    parser.add_argument('--soak-interval', type=int, default=100,
+                        dest='soak_interval',
+                        help='Number of games between soak samples')
+    parser.add_argument('--max-memory-growth', type=float, default=16.0,
+                        dest='max_memory_growth',
+                        help='Traced memory growth in MB after which the soak test fails (0: never)')
+    parser.add_argument('--max-latency-drift', type=float, default=0.5,
+                        dest='max_latency_drift',
+                        help='Relative increase of the time per tick after which the soak test fails (0: never)')
 
 
 def add_compatibility_arguments(parser: argparse.ArgumentParser):
@@ -50,8 +156,8 @@ def add_compatibility_arguments(parser: argparse.ArgumentParser):
                         dest='ghost',
                         help='the ghost agent TYPE in the ghostAgents module to use')
     parser.add_argument('-q', '--quietTextGraphics', action='store_true',
-                        dest='no_graphics',
-                        help='Run with no graphics (very fast)')
+                        dest='text_graphics',
+                        help='Draw the game as text in the terminal instead of a window')
     parser.add_argument('-k', '--numghosts', type=int,  default=4,
                         dest='n_ghosts',
                         help='The maximum number of ghosts to use')
@@ -69,19 +175,22 @@ def add_compatibility_arguments(parser: argparse.ArgumentParser):
 def get_run_configuration() -> Configuration:
     parser = argparse.ArgumentParser()
     add_arguments(parser)
+    add_queue_arguments(parser)
+    add_soak_arguments(parser)
     add_compatibility_arguments(parser)
     args = parser.parse_args()
+    if args.soak_interval < 1:
+        parser.error('--soak-interval must be at least 1')
 
     if args.fixed_seed:
         random.seed(13375339)
     elif args.seed > -1:
         random.seed(args.seed)
 
-    pacman, ghost = _load_pacman_and_ghost_from_module(
-        args.agent_module.replace('.py', ''), args.pacman, args.ghost)
+    pacman, ghost = load_agents(args.agent_module, args.pacman, args.ghost)
 
     frame_time = 0.0 if args.frame_time < 0.001 else 1.0 / args.frame_time
-    frame_rate = args.frame_rate if args.no_graphics or args.frame_rate != -2 else frame_time
+    frame_rate = args.frame_rate if args.frame_rate != -2 else frame_time
 
     return Configuration(
         load_layout(args.layout),
@@ -89,7 +198,14 @@ def get_run_configuration() -> Configuration:
         ghost,
         args.n_games,
         args.n_ghosts,
-        frame_rate
+        frame_rate,
+        args.record,
+        _get_queue_configuration(args) if args.queue else None,
+        SoakConfiguration(args.soak_interval, args.max_memory_growth, args.max_latency_drift) if args.soak else None,
+        args.text_graphics,
+        args.zoom,
+        args.frame_skip,
+        args.solve
     )
 
 
@@ -97,6 +213,36 @@ def load_layout(name: str) -> [str]:
     return _load_layout_from_disk('layouts/' + name + '.lay')
 
 
+def load_agents(agent_module: str, pacman: str, ghost: str) -> (Type[agent.Agent], Type[agent.Agent]):
+    return _load_pacman_and_ghost_from_module(agent_module.replace('.py', ''), pacman, ghost)
+
+
+def _get_queue_configuration(args: argparse.Namespace) -> QueueConfiguration:
+    if args.fixed_seed:
+        seed = 13375339
+    elif args.seed > -1:
+        seed = args.seed
+    else:
+        seed = random.randrange(1 << 31)
+
+    return QueueConfiguration(
+        args.queue,
+        args.worker,
+        args.n_jobs,
+        args.n_workers,
+        args.lease,
+        args.max_ticks,
+        args.max_attempts,
+        args.layout,
+        args.agent_module,
+        args.pacman,
+        args.ghost,
+        args.n_ghosts,
+        args.n_games,
+        seed
+    )
+
+
 def _load_layout_from_disk(path: str) -> [str]:
     data = []
     with open(path) as f:
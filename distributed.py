@@ -0,0 +1,336 @@
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import sys
+import time
+import traceback
+from cli import QueueConfiguration, load_agents, load_layout
+from game import Game
+from layout_tables import LayoutTables, get_table_directory
+
+__all__ = ['Job', 'JobQueue', 'run_coordinator', 'run_worker']
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    spec TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    job_id INTEGER PRIMARY KEY,
+    worker TEXT NOT NULL,
+    scores TEXT NOT NULL,
+    ticks INTEGER NOT NULL,
+    started REAL NOT NULL,
+    finished REAL NOT NULL
+);
+'''
+
+
+class Job:
+    def __init__(self,
+                 layout: str,
+                 agent_module: str,
+                 pacman: str,
+                 ghost: str,
+                 n_ghosts: int,
+                 seed: int,
+                 n_games: int,
+                 max_ticks: int = 0,
+                 job_id: int = None):
+
+        self.layout = layout
+        self.agent_module = agent_module
+        self.pacman = pacman
+        self.ghost = ghost
+        self.n_ghosts = n_ghosts
+        self.seed = seed
+        self.n_games = n_games
+        self.max_ticks = max_ticks
+        self.id = job_id
+
+    def to_json(self) -> str:
+        return json.dumps({k: v for k, v in self.__dict__.items() if k != 'id'})
+
+    @staticmethod
+    def from_json(spec: str, job_id: int = None):
+        return Job(job_id=job_id, **json.loads(spec))
+
+
+class JobQueue:
+    """
+    Job queue stored in a SQLite database on a filesystem shared by the coordinator and the workers.
+    Workers claim jobs with a lease which they renew while running; jobs whose lease expired are put back
+    as pending, and results of a worker that lost its lease are discarded.
+    Jobs that raise an exception, or whose lease expired max_attempts times, are marked as failed.
+    """
+
+    def __init__(self, path: str, timeout=60.0):
+        self.path = path
+        # rollback journal rather than WAL, which does not work on network filesystems
+        self._db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def enqueue(self, job: Job) -> int:
+        cursor = self._db.execute('INSERT INTO jobs (spec) VALUES (?)', (job.to_json(),))
+        job.id = cursor.lastrowid
+        return job.id
+
+    def claim(self, worker: str, lease: float):
+        with self._transaction():
+            row = self._db.execute(
+                "SELECT id, spec FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE jobs SET status = 'claimed', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE id = ?", (worker, time.time() + lease, row[0]))
+        return Job.from_json(row[1], row[0])
+
+    def renew(self, job: Job, worker: str, lease: float) -> bool:
+        cursor = self._db.execute(
+            "UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'claimed'",
+            (time.time() + lease, job.id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, job: Job, worker: str, scores: [int], ticks: int, started: float) -> bool:
+        with self._transaction():
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'done', lease_expires = NULL "
+                "WHERE id = ? AND worker = ? AND status = 'claimed'", (job.id, worker))
+            if cursor.rowcount != 1:
+                return False
+            self._db.execute(
+                'INSERT INTO results (job_id, worker, scores, ticks, started, finished) VALUES (?, ?, ?, ?, ?, ?)',
+                (job.id, worker, json.dumps(scores), ticks, started, time.time()))
+        return True
+
+    def fail(self, job: Job, worker: str, error: str) -> bool:
+        cursor = self._db.execute(
+            "UPDATE jobs SET status = 'failed', lease_expires = NULL, error = ? "
+            "WHERE id = ? AND worker = ? AND status = 'claimed'", (error, job.id, worker))
+        return cursor.rowcount == 1
+
+    def requeue_expired(self, max_attempts: int) -> int:
+        """
+        Puts jobs whose lease expired back as pending, or marks them as failed after max_attempts claims.
+        Returns the number of jobs put back.
+        """
+        now = time.time()
+        with self._transaction():
+            self._db.execute(
+                "UPDATE jobs SET status = 'failed', lease_expires = NULL, "
+                "error = 'lease expired ' || attempts || ' time(s), the worker may have died' "
+                "WHERE status = 'claimed' AND lease_expires < ? AND attempts >= ?", (now, max_attempts))
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'pending', worker = NULL, lease_expires = NULL "
+                "WHERE status = 'claimed' AND lease_expires < ?", (now,))
+        return cursor.rowcount
+
+    def get_counts(self) -> {str: int}:
+        counts = {'pending': 0, 'claimed': 0, 'done': 0, 'failed': 0}
+        counts.update(self._db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return counts
+
+    def get_retries(self) -> int:
+        """
+        Number of claims of finished jobs beyond the first, whose work was lost with an expired lease.
+        """
+        return self._db.execute("SELECT COALESCE(SUM(attempts - 1), 0) FROM jobs WHERE status = 'done'").fetchone()[0]
+
+    def get_failures(self) -> [(int, str, int, str)]:
+        """
+        Returns (job id, worker, attempts, error) for every failed job.
+        """
+        return self._db.execute(
+            "SELECT id, worker, attempts, error FROM jobs WHERE status = 'failed' ORDER BY id").fetchall()
+
+    def get_scores(self) -> [int]:
+        scores = []
+        for row in self._db.execute('SELECT scores FROM results ORDER BY job_id'):
+            scores.extend(json.loads(row[0]))
+        return scores
+
+    def get_throughput(self) -> [(str, int, int, int, float)]:
+        """
+        Returns (worker, jobs, games, ticks, busy seconds) for every worker that completed a job.
+        """
+        throughput = {}
+        for worker, scores, ticks, started, finished in self._db.execute(
+                'SELECT worker, scores, ticks, started, finished FROM results'):
+            jobs, games, total_ticks, busy = throughput.get(worker, (0, 0, 0, 0.0))
+            throughput[worker] = jobs + 1, games + len(json.loads(scores)), total_ticks + ticks, busy + finished - started
+        return [(worker, *values) for worker, values in sorted(throughput.items())]
+
+    # MARK: Private
+
+    def _transaction(self):
+        return _Transaction(self._db)
+
+
+class _Transaction:
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+    def __enter__(self):
+        # take the write lock up front so two workers can never claim the same job
+        self.db.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exception_type, *args):
+        self.db.execute('ROLLBACK' if exception_type else 'COMMIT')
+
+
+def run_coordinator(config: QueueConfiguration, poll_interval=1.0):
+    queue = JobQueue(config.path)
+    for i in range(config.n_jobs):
+        n_games = config.n_games // config.n_jobs + (i < config.n_games % config.n_jobs)
+        if n_games > 0:
+            queue.enqueue(Job(config.layout, config.agent_module, config.pacman, config.ghost,
+                              config.n_ghosts, config.seed + i, n_games, config.max_ticks))
+
+    # local workers share one copy of the layout tables instead of each parsing the layout
+    table_directory = get_table_directory() if config.n_workers > 0 else None
+    tables = {}
+    if table_directory is not None:
+        tables[config.layout] = LayoutTables.publish(
+            load_layout(config.layout), os.path.join(table_directory, f'{config.layout}.tables'))
+
+    try:
+        workers = [
+            multiprocessing.Process(target=run_worker, args=(config, f'{socket.gethostname()}-local-{i}', tables))
+            for i in range(config.n_workers)
+        ]
+        for worker in workers:
+            worker.start()
+
+        start = time.time()
+        while True:
+            requeued = queue.requeue_expired(config.max_attempts)
+            if requeued:
+                print(f'requeued {requeued} job(s) with expired leases')
+            counts = queue.get_counts()
+            if counts['pending'] + counts['claimed'] == 0:
+                break
+            if workers and counts['claimed'] == 0 and not any(worker.is_alive() for worker in workers):
+                print(f'all local workers exited, stopping with {counts["pending"]} job(s) pending')
+                break
+            time.sleep(poll_interval)
+        elapsed = time.time() - start
+
+        for worker in workers:
+            worker.join()
+    finally:
+        if table_directory is not None:
+            shutil.rmtree(table_directory, ignore_errors=True)
+
+    print_report(queue, elapsed)
+    queue.close()
+
+
+def run_worker(config: QueueConfiguration, name: str = None, tables: {str: str} = None, poll_interval=1.0):
+    """
+    Claims and runs jobs until none are pending or claimed by other workers.
+    Layouts with a table file in tables are attached to instead of parsed.
+    """
+    name = name or f'{socket.gethostname()}-{os.getpid()}'
+    queue = JobQueue(config.path)
+    attached_tables = {layout: LayoutTables(path) for layout, path in (tables or {}).items()}
+
+    while True:
+        queue.requeue_expired(config.max_attempts)
+        job = queue.claim(name, config.lease)
+        if job is None:
+            if queue.get_counts()['claimed'] == 0:
+                break
+            # another worker may still lose its lease
+            time.sleep(poll_interval)
+            continue
+
+        started = time.time()
+        try:
+            result = _run_job(job, lambda: queue.renew(job, name, config.lease), config.lease / 3.0,
+                              attached_tables.get(job.layout))
+        except Exception:
+            error = traceback.format_exc()
+            print(f'job {job.id} failed:\n{error}', file=sys.stderr)
+            queue.fail(job, name, error)
+            continue
+
+        if result is not None:
+            queue.complete(job, name, *result, started)
+
+    for layout_tables in attached_tables.values():
+        layout_tables.close()
+    queue.close()
+
+
+def print_report(queue: JobQueue, elapsed: float):
+    scores = queue.get_scores()
+    total_games = total_ticks = 0
+
+    print(f'{"worker":<32}{"jobs":>8}{"games":>8}{"ticks":>10}{"games/s":>10}{"ticks/s":>12}')
+    for worker, jobs, games, ticks, busy in queue.get_throughput():
+        total_games += games
+        total_ticks += ticks
+        busy = max(busy, 1e-9)
+        print(f'{worker:<32}{jobs:>8}{games:>8}{ticks:>10}{games / busy:>10.2f}{ticks / busy:>12.1f}')
+
+    elapsed = max(elapsed, 1e-9)
+    print(f'{"total":<40}{total_games:>8}{total_ticks:>10}{total_games / elapsed:>10.2f}{total_ticks / elapsed:>12.1f}')
+    for job_id, worker, attempts, error in queue.get_failures():
+        print(f'job {job_id} failed after {attempts} attempt(s) on {worker}: {error.strip().splitlines()[-1]}')
+    retries = queue.get_retries()
+    if retries:
+        print(f'{retries} job attempt(s) lost their lease and were run again')
+    if scores:
+        print(f'average score: {sum(scores) / len(scores):.2f} over {len(scores)} games')
+
+
+# MARK: Helper functions
+
+def _run_job(job: Job, renew, renew_interval: float, tables: LayoutTables = None) -> ([int], int):
+    random.seed(job.seed)
+    pacman, ghost = load_agents(job.agent_module, job.pacman, job.ghost)
+    if tables is None:
+        game = Game(load_layout(job.layout), pacman, ghost, job.n_ghosts)
+    else:
+        game = Game(tables.layout, pacman, ghost, job.n_ghosts, tables)
+
+    scores, total_ticks = [], 0
+    next_renewal = time.time() + renew_interval
+
+    def keep_lease() -> bool:
+        # by elapsed time rather than ticks, so that jobs of many short games are renewed too
+        nonlocal next_renewal
+        if time.time() < next_renewal:
+            return True
+        next_renewal = time.time() + renew_interval
+        return renew()
+
+    for _ in range(job.n_games):
+        ticks = 0
+        while game.is_running() and (job.max_ticks <= 0 or ticks < job.max_ticks):
+            game.update()
+            ticks += 1
+            if not keep_lease():
+                return None  # lease lost, the job was handed to another worker
+
+        if not keep_lease():
+            return None
+        scores.append(game.score)
+        total_ticks += ticks
+        game.reset()
+
+    return scores, total_ticks
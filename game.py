@@ -1,9 +1,13 @@
-
+import heapq
 
 __all__ = ['Direction', 'Game']
 
 GHOST_COLORS = ['red', 'green', 'blue', 'orange']
 
+# offsets of the open directions for every set of direction bits, bit (direction - 1) per direction
+NEIGHBOUR_OFFSETS = [[offset for bit, offset in enumerate([(1, 0), (0, 1), (-1, 0), (0, -1)]) if bits & (1 << bit)]
+                     for bits in range(16)]
+
 
 class Direction:
     North = 2
@@ -67,33 +71,68 @@ class Map:
         'ghost': Flags.Ghost,
     }
 
-    def __init__(self, layout: [str]):
+    def __init__(self, layout: [str], tables: 'LayoutTables' = None):
+        """
+        Parses the layout, or with tables of the layout reads its static grids from them instead.
+        """
         self.layout = layout
-        self.map = [[0 for _ in range(len(layout[0]))] for _ in range(len(layout))]
-        self.food = [[False for _ in range(len(layout[0]))] for _ in range(len(layout))]
-        self.walls = [[False for _ in range(len(layout[0]))] for _ in range(len(layout))]
-        self.pacman_initial_position = 0, 0
-        self.ghost_initial_positions = []
-        self._parse_map(layout)
-        self.initial_food = [[v for v in row] for row in self.food]
+        self.tables = tables
+        if tables is None:
+            self.map = [[0 for _ in range(len(layout[0]))] for _ in range(len(layout))]
+            self.food = [[False for _ in range(len(layout[0]))] for _ in range(len(layout))]
+            self.walls = [[False for _ in range(len(layout[0]))] for _ in range(len(layout))]
+            self.pacman_initial_position = 0, 0
+            self.ghost_initial_positions = []
+            self._parse_map(layout)
+            self.initial_food = [[v for v in row] for row in self.food]
+        else:
+            # static grids are read-only views into the shared tables, only the mutable state is copied
+            self.map = [list(row) for row in tables.flags]
+            self.food = [[bool(v) for v in row] for row in tables.food]
+            self.walls = tables.walls
+            self.pacman_initial_position = tables.pacman_initial_position
+            self.ghost_initial_positions = list(tables.ghost_initial_positions)
+            self.initial_food = tables.food
         self.width = len(self.map[0])
         self.height = len(self.map)
+        self.version = 0  # incremented on every change, used to invalidate cached queries
+        self.observers = []  # called with (x, y) of every changed square
+        self._directions = None
+
+    @staticmethod
+    def from_tables(tables: 'LayoutTables'):
+        return Map(tables.layout, tables)
 
     def add(self, flag: int, x: int, y: int):
         self.map[y][x] |= flag
+        self.version += 1
         if (flag & Flags.Food) > 0:
             self.food[y][x] = True
+        for observer in self.observers:
+            observer(x, y)
 
     def remove(self, flag: int, x: int, y: int):
         self.map[y][x] &= ~flag
+        self.version += 1
         if (flag & Flags.Food) > 0:
             self.food[y][x] = False
+        for observer in self.observers:
+            observer(x, y)
 
     def is_at(self, flag: int, x: int, y: int):
         return (self.map[y][x] & flag) > 0
 
+    def get_directions(self) -> bytearray:
+        """
+        The open directions of every square, see NEIGHBOUR_OFFSETS, indexed by y * width + x.
+        Computed on first use, or read from the shared tables, and shared by everything that searches the map.
+        """
+        if self._directions is None:
+            self._directions = self._find_directions() if self.tables is None else self.tables.directions
+        return self._directions
+
     def reset(self):
-        self.food = [[v for v in row] for row in self.initial_food]
+        self.food = [[bool(v) for v in row] for row in self.initial_food]
         for y, row in enumerate(self.food):
             for x, is_there in enumerate(row):
                 self.add(Flags.Food * is_there, x, y)
@@ -102,6 +141,17 @@ class Map:
         for pos in self.ghost_initial_positions:
             self.add(Flags.Ghost, *pos)
 
+    def _find_directions(self) -> bytearray:
+        directions = bytearray(self.width * self.height)
+        for y in range(self.height):
+            for x in range(self.width):
+                if self.walls[y][x]:
+                    continue
+                for bit, (dx, dy) in enumerate(NEIGHBOUR_OFFSETS[15]):
+                    if 0 <= x + dx < self.width and 0 <= y + dy < self.height and not self.walls[y + dy][x + dx]:
+                        directions[y * self.width + x] |= 1 << bit
+        return directions
+
     def _parse_map(self, layout: [str]):
         for y, row in enumerate(reversed(layout)):
             for x, square in enumerate(row):
@@ -114,6 +164,225 @@ class Map:
                     self.ghost_initial_positions.append((x, y))
 
 
+class DistanceField:
+    """
+    Maze distances to the nearest of a set of source cells, e.g. the positions of all living ghosts.
+    The field is computed with a multi-source BFS over the open directions of the map on first access.
+    Afterwards source changes are queued and applied incrementally on the next access. A source that moves changes
+    the whole region nearest to it, so the field is recomputed instead once the changes reach the number of sources,
+    for example whenever the only source moves, or when a removed source invalidates a large region.
+    """
+
+    Unreachable = -1
+
+    _INFINITY = 1 << 30
+    _MAX_PENDING_CHANGES = 16
+    _MAX_INVALID_SHARE = 0.5  # of the open squares
+
+    def __init__(self, game_map: Map, sources: [(int, int)]):
+        self.width = game_map.width
+        self.height = game_map.height
+        self._map = game_map
+        self._directions = None
+        self._offsets = None
+        self._max_invalid = 0
+        self._sources = {}
+        self._pending = []
+        self._distances = None
+        self.reset(sources)
+
+    def __getitem__(self, position: (int, int)) -> int:
+        x, y = position
+        if not self._contains(x, y):
+            return DistanceField.Unreachable
+
+        distance = self._get_distances()[y * self.width + x]
+        return DistanceField.Unreachable if distance >= DistanceField._INFINITY else distance
+
+    def reset(self, sources: [(int, int)]):
+        self._sources.clear()
+        for position in sources:
+            self._sources[position] = self._sources.get(position, 0) + 1
+        self._pending.clear()
+        self._distances = None
+
+    def add(self, position: (int, int)):
+        count = self._sources.get(position, 0)
+        self._sources[position] = count + 1
+        if count == 0:
+            self._queue_change(position)
+
+    def remove(self, position: (int, int)):
+        count = self._sources.get(position, 0)
+        if count <= 1:
+            self._sources.pop(position, None)
+            if count == 1:
+                self._queue_change(position)
+        else:
+            self._sources[position] = count - 1
+
+    def move(self, source: (int, int), destination: (int, int)):
+        self.add(destination)
+        self.remove(source)
+
+    # MARK: Private
+
+    def _contains(self, x: int, y: int) -> bool:
+        return 0 <= x < self.width and 0 <= y < self.height and not self._map.walls[y][x]
+
+    def _queue_change(self, position: (int, int)):
+        if self._distances is None or not self._contains(*position):
+            return
+
+        self._pending.append(position)
+        # every moved source changes the distances of the whole region it is nearest to, by one
+        if len(self._pending) >= min(len(self._sources), DistanceField._MAX_PENDING_CHANGES):
+            self._pending.clear()
+            self._distances = None
+
+    def _get_distances(self) -> [int]:
+        if self._distances is None:
+            self._compute()
+        elif self._pending:
+            # sources are inserted first, so that removed ones next to them invalidate less
+            pending = sorted(dict.fromkeys(self._pending), key=lambda position: position not in self._sources)
+            self._pending.clear()
+            for x, y in pending:
+                if (x, y) in self._sources:
+                    self._insert_source(y * self.width + x)
+                elif not self._delete_source(y * self.width + x):
+                    self._compute()
+                    break
+        return self._distances
+
+    def _compute(self):
+        if self._directions is None:
+            self._directions = self._map.get_directions()
+            self._offsets = [[dx + dy * self.width for dx, dy in offsets] for offsets in NEIGHBOUR_OFFSETS]
+            n_open = sum(not is_wall for row in self._map.walls for is_wall in row)
+            self._max_invalid = int(n_open * DistanceField._MAX_INVALID_SHARE)
+
+        self._distances = [DistanceField._INFINITY] * (self.width * self.height)
+        queue = []
+        for x, y in self._sources:
+            if self._contains(x, y):
+                self._distances[y * self.width + x] = 0
+                queue.append(y * self.width + x)
+        self._propagate(queue)
+
+    def _insert_source(self, cell: int):
+        if self._distances[cell] != 0:
+            self._distances[cell] = 0
+            self._propagate([cell])
+
+    def _propagate(self, queue: [int]):
+        distances, directions, offsets = self._distances, self._directions, self._offsets
+        # the loop also visits the cells appended while it runs, in BFS order
+        for cell in queue:
+            distance = distances[cell] + 1
+            for offset in offsets[directions[cell]]:
+                neighbour = cell + offset
+                if distances[neighbour] > distance:
+                    distances[neighbour] = distance
+                    queue.append(neighbour)
+
+    def _delete_source(self, source: int) -> bool:
+        """
+        Repairs the region that depended on a removed source, or returns False if it is too large to be worth it.
+        """
+        distances, directions, offsets = self._distances, self._directions, self._offsets
+        if distances[source] != 0:
+            return True
+
+        # Cells lose their distance when every neighbour one step closer lost it too. The BFS visits levels in order,
+        # so all invalidated cells of a level are marked before the next level is checked.
+        distances[source] = DistanceField._INFINITY
+        invalid = [(source, 0)]
+        for cell, level in invalid:
+            for offset in offsets[directions[cell]]:
+                neighbour = cell + offset
+                if distances[neighbour] != level + 1:
+                    continue
+                for parent_offset in offsets[directions[neighbour]]:
+                    if distances[neighbour + parent_offset] == level:
+                        break
+                else:
+                    distances[neighbour] = DistanceField._INFINITY
+                    invalid.append((neighbour, level + 1))
+            if len(invalid) > self._max_invalid:
+                return False
+
+        # A source that moved one step is a source next to the removed one. Every path through the removed source
+        # is then one step longer through the new one, which is exactly what the invalidated cells lose.
+        if any(distances[source + offset] == 0 for offset in offsets[directions[source]]):
+            for cell, level in invalid:
+                distances[cell] = level + 1
+            return True
+
+        # Otherwise reconnect invalidated cells to the still valid boundary, nearest first
+        heap = []
+        for cell, _ in invalid:
+            distance = min((distances[cell + offset] for offset in offsets[directions[cell]]),
+                           default=DistanceField._INFINITY) + 1
+            if distance < DistanceField._INFINITY:
+                distances[cell] = distance
+                heap.append((distance, cell))
+
+        heapq.heapify(heap)
+        while heap:
+            distance, cell = heapq.heappop(heap)
+            if distance != distances[cell]:
+                continue
+            for offset in offsets[directions[cell]]:
+                neighbour = cell + offset
+                if distances[neighbour] > distance + 1:
+                    distances[neighbour] = distance + 1
+                    heapq.heappush(heap, (distance + 1, neighbour))
+        return True
+
+
+class QueryCache:
+    """
+    Memoizes pure game queries for the current map version. Queries must not return None.
+    Static queries, which only depend on the walls, are kept for the lifetime of the cache.
+    """
+
+    def __init__(self):
+        self.hits = {}
+        self.misses = {}
+        self._version = None
+        self._values = {}
+        self._static_values = {}
+
+    def get(self, version: int, query: str, argument, compute, *args):
+        if version != self._version:
+            self._version = version
+            self._values.clear()
+        return self._get(self._values, query, argument, compute, args)
+
+    def get_static(self, query: str, argument, compute, *args):
+        return self._get(self._static_values, query, argument, compute, args)
+
+    def get_stats(self) -> {str: (int, int)}:
+        """
+        Returns (hits, misses) per query.
+        """
+        return {query: (self.hits.get(query, 0), self.misses.get(query, 0))
+                for query in sorted(set(self.hits) | set(self.misses))}
+
+    # MARK: Private
+
+    def _get(self, values: dict, query: str, argument, compute, args: tuple):
+        key = query, argument
+        value = values.get(key)
+        if value is None:
+            self.misses[query] = self.misses.get(query, 0) + 1
+            value = values[key] = compute(*args)
+        else:
+            self.hits[query] = self.hits.get(query, 0) + 1
+        return value
+
+
 class Game:
 
     SCORE_PER_FOOD = 10
@@ -127,14 +396,19 @@ class Game:
         Direction.Stop: (0, 0)
     }
 
-    def __init__(self, layout: [str], pacman, ghost, n_ghosts: int):
+    def __init__(self, layout: [str], pacman, ghost, n_ghosts: int, tables: 'LayoutTables' = None):
         self.score = 0
-        self.map = Map(layout)
+        self.tick = 0
+        self.queries = QueryCache()
+        self.map = Map(layout) if tables is None else Map.from_tables(tables)
         self.pacman = pacman('pacman', self.map.pacman_initial_position)
         self.ghosts = [ghost('ghost', pos) for pos, _ in zip(self.map.ghost_initial_positions, range(n_ghosts))]
         for ghost, color in zip(self.ghosts, GHOST_COLORS):
             ghost.color = color
 
+        self.ghost_distance_field = DistanceField(self.map, [g.position for g in self.ghosts])
+        self.pacman_distance_field = DistanceField(self.map, [self.pacman.position])
+
         for agent in self.ghosts + [self.pacman]:
             agent.initialize()
 
@@ -142,18 +416,11 @@ class Game:
         return self.get_legal_actions(self.pacman)
 
     def get_legal_actions(self, agent) -> [int]:
-        legal = []
-
-        for direction in range(1, 5):
-
-            position = agent.position[0] + Game.Moves[direction][0],\
-                       agent.position[1] + Game.Moves[direction][1]
-
-            if not self.map.is_at(Flags.Wall, *position) \
-                    and (not self.map.is_at(Flags.Ghost, *position) or agent.name == 'pacman'):
-                legal.append(direction)
+        key = agent.name == 'pacman', agent.position
+        return list(self.queries.get(self.map.version, 'legal_actions', key, self._find_legal_actions, *key))
 
-        return legal
+    def get_neighbours(self, position: (int, int)) -> [(int, int)]:
+        return list(self.queries.get_static('neighbours', position, self._find_neighbours, position))
 
     def is_running(self):
         return any(g.alive for g in self.ghosts)
@@ -161,11 +428,15 @@ class Game:
     def reset(self):
         self.map.reset()
         self.score = 0
+        self.tick = 0
         self.pacman.position = self.map.pacman_initial_position
         for ghost, position in zip(self.ghosts, self.map.ghost_initial_positions):
             ghost.alive = True
             ghost.position = position
 
+        self.ghost_distance_field.reset([g.position for g in self.ghosts])
+        self.pacman_distance_field.reset([self.pacman.position])
+
         for agent in self.ghosts + [self.pacman]:
             agent.initialize()
 
@@ -174,6 +445,7 @@ class Game:
             self.update()
 
     def update(self):
+        self.tick += 1
         self.score -= 1
 
         for agent in self.ghosts + [self.pacman]:
@@ -185,7 +457,9 @@ class Game:
             direction = agent.choose_action(self)
             agent.previous_position = position
 
-            if direction in self.get_legal_actions(agent):
+            # checked directly rather than through the memoized get_legal_actions, which costs more than it saves
+            # for agents that do not query legal actions themselves
+            if self._is_legal_action(agent.name == 'pacman', position, direction):
 
                 offset = Game.Moves[direction]
                 agent.position = (position[0] + offset[0], position[1] + offset[1])
@@ -193,6 +467,7 @@ class Game:
 
                 self.map.remove(Map.Square[agent.name], *position)
                 self.map.add(Map.Square[agent.name], *agent.position)
+                self._get_distance_field(agent).move(position, agent.position)
 
                 if agent.name == 'pacman' or Direction.is_opposite(self.pacman.direction, agent.direction):
                     self._update_map_and_score()
@@ -201,6 +476,23 @@ class Game:
 
     # MARK: Private
 
+    def _find_legal_actions(self, is_pacman: bool, position: (int, int)) -> [int]:
+        return [direction for direction in range(1, 5) if self._is_legal_action(is_pacman, position, direction)]
+
+    def _is_legal_action(self, is_pacman: bool, position: (int, int), direction: int) -> bool:
+        if direction not in Game.Moves or direction == Direction.Stop:
+            return False
+
+        square = self.map.map[position[1] + Game.Moves[direction][1]][position[0] + Game.Moves[direction][0]]
+        return (square & Flags.Wall) == 0 and (is_pacman or (square & Flags.Ghost) == 0)
+
+    def _find_neighbours(self, position: (int, int)) -> [(int, int)]:
+        x, y = position
+        return [(x + dx, y + dy) for dx, dy in NEIGHBOUR_OFFSETS[self.map.get_directions()[y * self.map.width + x]]]
+
+    def _get_distance_field(self, agent) -> DistanceField:
+        return self.pacman_distance_field if agent.name == 'pacman' else self.ghost_distance_field
+
     def _update_map_and_score(self):
         # pacman eats food
         if self.map.is_at(Flags.Food, *self.pacman.position):
@@ -213,5 +505,6 @@ class Game:
             self.score += Game.SCORE_PER_GHOST
             for g in self.ghosts:
                 if g.alive and g.position == self.pacman.position:
+                    self.ghost_distance_field.remove(g.position)
                     g.alive = False
                     g.position = -1000, -1000
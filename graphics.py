@@ -158,12 +158,12 @@ class PacmanGraphics:
 
     PACMAN_WAKAS_PER_SECOND = 2.0
 
-    def __init__(self, app: tk.Frame, frame_rate: float, unit_size: float, map_size: (int, int)):
-        self.game = app.game  # this is ugly, remove this
-        self.graphics = Graphics(app)
+    def __init__(self, graphics: Graphics, frame_rate: float, unit_size: float, map_size: (int, int)):
+        self.graphics = graphics
         self.frame_rate = frame_rate or 1e-8
         self.unit_size = unit_size
         self.width, self.height = map_size
+        self.clock = time.time  # drives the pacman mouth animation
 
     def draw_map(self, walls: [[bool]]):
         self._draw_map(walls)
@@ -230,7 +230,7 @@ class PacmanGraphics:
         for i, ghost in enumerate(reversed(ghosts)):
             distance = abs(ghost.position[0] - pacman.position[0]) + abs(ghost.position[1] - pacman.position[1])
             self.graphics.draw_text(
-                position[0] - i * 80,
+                position[0] - i * 2 * self.unit_size,
                 position[1],
                 text=f'{distance if ghost.alive else -1}',
                 font=font,
@@ -240,7 +240,7 @@ class PacmanGraphics:
 
     def _draw_pacman(self, pacman: Agent, dt: float):
         pacman_direction = pacman.direction
-        pacman_mouth_angle = 40 + 20 * math.sin(time.time() * math.pi * 2 * PacmanGraphics.PACMAN_WAKAS_PER_SECOND)
+        pacman_mouth_angle = 40 + 20 * math.sin(self.clock() * math.pi * 2 * PacmanGraphics.PACMAN_WAKAS_PER_SECOND)
         self.graphics.draw_arc(
             *self._animate_position(pacman, dt),
             self.unit_size / 2.4,
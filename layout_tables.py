@@ -0,0 +1,118 @@
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from game import Map
+
+__all__ = ['LayoutTables', 'get_table_directory']
+
+
+MAGIC = b'PMLT'
+
+# magic, width, height, pacman x, pacman y, number of ghosts, number of squares, layout size
+HEADER = struct.Struct('<4sHHHHHII')
+
+
+class LayoutTables:
+    """
+    Read-only tables derived from a layout, stored in one memory-mapped file so that every process running games
+    on the layout shares a single copy: the initial square flags, walls, initial food and the open directions
+    of every square as returned by Map.get_directions.
+    The parent publishes the file once, worker processes attach to it and create maps with Map.from_tables.
+    Games on such maps read their neighbours and distance field adjacency from the tables instead of building them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._map)
+
+        magic, self.width, self.height, pacman_x, pacman_y, n_ghosts, self.n_squares, layout_size = \
+            HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a layout table file')
+
+        offset = _align(HEADER.size)
+        self.layout = bytes(buffer[offset:offset + layout_size]).decode().split('\n')
+        offset = _align(offset + layout_size)
+        ghosts = buffer[offset:offset + n_ghosts * 4].cast('H')
+        offset = _align(offset + n_ghosts * 4)
+        self.pacman_initial_position = pacman_x, pacman_y
+        self.ghost_initial_positions = [(ghosts[2 * i], ghosts[2 * i + 1]) for i in range(n_ghosts)]
+
+        size = self.width * self.height
+        grids = []
+        for _ in range(3):
+            grid = buffer[offset:offset + size]
+            grids.append([grid[y * self.width:(y + 1) * self.width] for y in range(self.height)])
+            offset = _align(offset + size)
+        self.flags, self.walls, self.food = grids
+        # indexed by y * width + x like Map.get_directions, which returns it for maps created from the tables
+        self.directions = buffer[offset:offset + size]
+
+    def close(self):
+        """
+        Releases the views, which maps created from the tables can no longer use, and unmaps the file.
+        If a view is still exported, for example wrapped by a NumPy array, the file stays mapped until the process exits.
+        """
+        views = [row for grid in [self.flags, self.walls, self.food] for row in grid]
+        is_exported = False
+        for view in views + [self.directions]:
+            try:
+                view.release()
+            except BufferError:
+                is_exported = True
+        try:
+            self._map.close()
+        except BufferError:
+            is_exported = True
+
+        if is_exported:
+            print(f'{self.path} is still exported by a view, it stays mapped until the process exits', file=sys.stderr)
+        self._file.close()
+
+    @staticmethod
+    def publish(layout: [str], path: str) -> str:
+        """
+        Parses the layout, computes its tables and writes them to path, which is returned.
+        """
+        game_map = Map(layout)
+        width, height = game_map.width, game_map.height
+        n_squares = sum(not is_wall for row in game_map.walls for is_wall in row)
+
+        pacman_x, pacman_y = game_map.pacman_initial_position
+        layout_text = '\n'.join(layout).encode()
+        parts = [HEADER.pack(MAGIC, width, height, pacman_x, pacman_y,
+                             len(game_map.ghost_initial_positions), n_squares, len(layout_text))]
+        parts.append(layout_text)
+        parts.append(struct.pack(f'<{2 * len(game_map.ghost_initial_positions)}H',
+                                 *[v for position in game_map.ghost_initial_positions for v in position]))
+        for grid in [game_map.map, game_map.walls, game_map.initial_food]:
+            parts.append(bytes(int(v) for row in grid for v in row))
+        parts.append(bytes(game_map.get_directions()))
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temporary_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            for part in parts:
+                f.write(part)
+                f.write(bytes(_align(f.tell()) - f.tell()))
+        # readers never see a partially written file
+        os.replace(temporary_path, path)
+        return path
+
+
+# MARK: Helper functions
+
+def get_table_directory() -> str:
+    """
+    A new directory for table files, in memory backed /dev/shm when the system has one.
+    """
+    return tempfile.mkdtemp(prefix='pacman-tables-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
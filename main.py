@@ -1,17 +1,47 @@
-
+import sys
 from cli import get_run_configuration
 
 if __name__ == '__main__':
     app = None
     config = get_run_configuration()
 
-    if config.frame_rate < 0:   # graphics disabled
+    if config.queue:            # distributed batches
+        from distributed import run_coordinator, run_worker
+        if config.queue.worker:
+            run_worker(config.queue)
+        else:
+            run_coordinator(config.queue)
+        sys.exit(0)
+
+    if config.solve:            # optimal score search
+        from solver import solve
+        try:
+            solution = solve(config.layout, config.ghost, config.n_ghosts)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            sys.exit(1)
+        print(solution or 'no game can be finished')
+        sys.exit(0 if solution and solution.verified else 1)
+
+    if config.record:           # offscreen rendering
+        from game import Game
+        from offscreen import Recorder
+        app = Recorder(Game(config.layout, config.pacman, config.ghost, config.n_ghosts), config.record, config.frame_rate)
+    elif config.frame_rate < 0: # graphics disabled
         from game import Game
         app = Game(config.layout, config.pacman, config.ghost, config.n_ghosts)
+    elif config.text_graphics:  # text graphics
+        from text_graphics import TextApplication
+        app = TextApplication(config.layout, config.pacman, config.ghost, config.n_ghosts, config.frame_rate,
+                              config.zoom, config.frame_skip)
     else:                       # graphics enabled
         from app import Application
         app = Application(config.layout, config.pacman, config.ghost, config.n_ghosts, config.frame_rate)
 
+    if config.soak:             # soak test
+        from soak import run_soak_test
+        sys.exit(run_soak_test(app, getattr(app, 'game', app), config.n_games, config.soak))
+
     for _ in range(config.n_games):
         app.run()
         app.reset()
@@ -0,0 +1,484 @@
+import functools
+import itertools
+import os
+import struct
+import zlib
+import numpy as np
+from game import Game
+from graphics import PacmanGraphics
+
+__all__ = ['RasterGraphics', 'OffscreenGraphics', 'GifWriter', 'Recorder', 'save_png']
+
+
+COLORS = {
+    'black': (0, 0, 0),
+    'white': (255, 255, 255),
+    'gray': (190, 190, 190),
+    'grey': (190, 190, 190),
+    'red': (255, 0, 0),
+    'green': (0, 255, 0),
+    'blue': (0, 0, 255),
+    'orange': (255, 165, 0),
+    'yellow': (255, 255, 0),
+}
+
+# 3x5 bitmap glyphs for the characters used by the score and distance labels
+FONT = {
+    '0': ['111', '101', '101', '101', '111'],
+    '1': ['010', '110', '010', '010', '111'],
+    '2': ['111', '001', '111', '100', '111'],
+    '3': ['111', '001', '111', '001', '111'],
+    '4': ['101', '101', '111', '001', '001'],
+    '5': ['111', '100', '111', '001', '111'],
+    '6': ['111', '100', '111', '101', '111'],
+    '7': ['111', '001', '001', '001', '001'],
+    '8': ['111', '101', '111', '101', '111'],
+    '9': ['111', '101', '111', '001', '111'],
+    '-': ['000', '000', '111', '000', '000'],
+    ':': ['000', '010', '000', '010', '000'],
+    'S': ['111', '100', '111', '001', '111'],
+    'c': ['000', '111', '100', '100', '111'],
+    'o': ['000', '111', '101', '101', '111'],
+    'r': ['000', '111', '100', '100', '100'],
+    'e': ['111', '101', '111', '100', '111'],
+}
+
+# GIF pixels that did not change since the previous frame, outside of the 24 bit RGB range
+TRANSPARENT = 1 << 24
+
+GLYPHS = {c: np.array([[b == '1' for b in row] for row in rows]) for c, rows in FONT.items()}
+
+
+class RasterGraphics:
+    """
+    Drop-in replacement for graphics.Graphics that rasterizes into a NumPy RGB buffer instead of a Tk canvas.
+    Permanent objects are drawn into a background layer which clear() copies back into the frame.
+    Outlines are not drawn, only fills. Point sizes in fonts are multiplied by font_scale.
+    """
+
+    def __init__(self, width: int, height: int, background='black', font_scale=1.0):
+        self.font_scale = font_scale
+        self.background = np.empty((height, width, 3), dtype=np.uint8)
+        self.background[:] = parse_color(background)
+        self.frame = self.background.copy()
+        self._model_masks = {}
+
+    def clear(self):
+        np.copyto(self.frame, self.background)
+
+    def draw_arc(self,
+                 x: float,
+                 y: float,
+                 radius: float,
+                 angle=359.99,
+                 start_angle=0.0,
+                 color="#fb0",
+                 border="#000",
+                 permanent=False):
+
+        window = self._get_window(x - radius, y - radius, x + radius, y + radius)
+        if window is None:
+            return
+
+        px, py = window[2:]
+        dx, dy = px - x, y - py
+        mask = dx * dx + dy * dy <= radius * radius
+        if angle < 359.0:
+            theta = np.degrees(np.arctan2(dy, dx))
+            mask &= (theta - start_angle) % 360.0 <= angle
+
+        self._fill(window[0], window[1], mask, color, permanent)
+
+    def draw_polygon(self,
+                     points: [(float, float)],
+                     width=1.0,
+                     smooth=False,
+                     color="#fb0",
+                     border="#000",
+                     permanent=False):
+
+        points = _smooth_polygon(points) if smooth else points
+        xs, ys = [p[0] for p in points], [p[1] for p in points]
+        window = self._get_window(min(xs), min(ys), max(xs), max(ys))
+        if window is None:
+            return
+
+        self._fill(window[0], window[1], _polygon_mask(points, *window[2:]), color, permanent)
+
+    def draw_rect(self,
+                  x: float,
+                  y: float,
+                  width: float,
+                  height: float,
+                  color="#fb0",
+                  border="#000",
+                  permanent=False):
+
+        x0, y0 = max(0, int(round(x))), max(0, int(round(y)))
+        x1, y1 = int(round(x + width)), int(round(y + height))
+        for target in self._get_targets(permanent):
+            target[y0:y1, x0:x1] = parse_color(color)
+
+    def draw_models(self,
+                    size: float,
+                    model: [(float, float)],
+                    positions: [(float, float)],
+                    width=1.0,
+                    smooth=True,
+                    colors: [str] = None,
+                    borders: [str] = None,
+                    permanent=False):
+
+        # The model is rasterized once per (model, size) and stamped at pixel-rounded positions,
+        # which keeps frames with many food pellets and ghosts cheap to draw.
+        key = id(model), size, smooth
+        if key not in self._model_masks:
+            points = [(vertex[0] * size, vertex[1] * size) for vertex in model]
+            points = _smooth_polygon(points) if smooth else points
+            left = int(np.floor(min(p[0] for p in points)))
+            top = int(np.floor(min(p[1] for p in points)))
+            right = int(np.ceil(max(p[0] for p in points)))
+            bottom = int(np.ceil(max(p[1] for p in points)))
+            px = np.arange(left, right, dtype=np.float64)[np.newaxis, :] + 0.5
+            py = np.arange(top, bottom, dtype=np.float64)[:, np.newaxis] + 0.5
+            self._model_masks[key] = left, top, _polygon_mask(points, px, py)
+
+        left, top, mask = self._model_masks[key]
+        colors = colors or ["#fb0" for _ in range(len(positions))]
+        for position, color in zip(positions, colors):
+            self._fill(int(round(position[0])) + left, int(round(position[1])) + top, mask, color, permanent)
+
+    def draw_text(self,
+                  x: float,
+                  y: float,
+                  text: str,
+                  font="Helvetica 12 normal",
+                  anchor="nw",
+                  color="#fff",
+                  permanent=False):
+
+        scale = max(1, int(int(font.split(' ')[1]) * self.font_scale) // 7)
+        mask = np.zeros((5, 4 * len(text)), dtype=bool)
+        for i, character in enumerate(text):
+            if character in GLYPHS:
+                mask[:, 4 * i:4 * i + 3] = GLYPHS[character]
+        mask = mask.repeat(scale, axis=0).repeat(scale, axis=1)
+
+        left = int(round(x)) - (mask.shape[1] if 'e' in anchor else 0)
+        self._fill(left, int(round(y)), mask, color, permanent)
+
+    # MARK: Private
+
+    def _get_targets(self, permanent: bool) -> [np.ndarray]:
+        return [self.background, self.frame] if permanent else [self.frame]
+
+    def _get_window(self, left: float, top: float, right: float, bottom: float):
+        height, width = self.frame.shape[:2]
+        x0, y0 = max(0, int(np.floor(left))), max(0, int(np.floor(top)))
+        x1, y1 = min(width, int(np.ceil(right)) + 1), min(height, int(np.ceil(bottom)) + 1)
+        if x0 >= x1 or y0 >= y1:
+            return None
+
+        px = np.arange(x0, x1, dtype=np.float64)[np.newaxis, :] + 0.5
+        py = np.arange(y0, y1, dtype=np.float64)[:, np.newaxis] + 0.5
+        return x0, y0, px, py
+
+    def _fill(self, left: int, top: int, mask: np.ndarray, color: str, permanent: bool):
+        height, width = self.frame.shape[:2]
+        x0, y0 = max(0, left), max(0, top)
+        x1, y1 = min(width, left + mask.shape[1]), min(height, top + mask.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        mask = mask[y0 - top:y1 - top, x0 - left:x1 - left]
+        for target in self._get_targets(permanent):
+            target[y0:y1, x0:x1][mask] = parse_color(color)
+
+
+class OffscreenGraphics(PacmanGraphics):
+    """
+    PacmanGraphics drawing into a RasterGraphics buffer, so frames can be produced without Tk or a display.
+    """
+
+    def __init__(self, frame_rate: float, unit_size: float, map_size: (int, int)):
+        width, height = map_size
+        super().__init__(
+            # Fonts in PacmanGraphics are sized for the 40 pixel units of the Tk application
+            RasterGraphics(int(unit_size * (2 + width)), int(unit_size * (3 + height)), font_scale=unit_size / 40.0),
+            frame_rate,
+            unit_size,
+            map_size
+        )
+        self.time = 0.0
+        self.clock = lambda: self.time
+
+    def render(self, game: Game, dt: float = None) -> np.ndarray:
+        """
+        Draws the game and returns the frame buffer, which is overwritten by the next call.
+        By default agents are drawn at their current positions (no interpolation).
+        """
+        dt = self.frame_rate if dt is None else dt
+        self.draw(game, dt)
+        self.time += dt
+        return self.graphics.frame
+
+
+class GifWriter:
+    """
+    Streams frames into an animated GIF, one local color table per frame.
+    After the first frame only the bounding box of the pixels that changed is encoded and drawn over the previous frame,
+    with the pixels in it that did not change left transparent.
+    """
+
+    def __init__(self, path: str, frame_duration: float):
+        self.file = open(path, 'wb')
+        self.delay = max(1, int(round(frame_duration * 100)))
+        self.size = None
+        self.previous = None
+
+    def write(self, frame: np.ndarray):
+        height, width = frame.shape[:2]
+        if self.size is None:
+            self.size = width, height
+            self.file.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0, 0, 0))
+            # Loop forever
+            self.file.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00')
+
+        left, top, right, bottom = _get_changed_box(self.previous, frame)
+        region = frame[top:bottom, left:right]
+        packed = (region[..., 0].astype(np.uint32) << 16) | (region[..., 1].astype(np.uint32) << 8) | region[..., 2]
+        if self.previous is not None:
+            # Unchanged pixels become one transparent color, sorted after all RGB colors, whose long runs compress well
+            packed[np.all(self.previous[top:bottom, left:right] == region, axis=2)] = TRANSPARENT
+        self.previous = frame.copy()
+
+        colors, indices = np.unique(packed, return_inverse=True)
+        has_transparency = bool(colors[-1] == TRANSPARENT)
+        if len(colors) > 256:
+            raise ValueError(f'frame has {len(colors)} colors, GIF supports at most 256')
+
+        bits = max(1, int(len(colors) - 1).bit_length())
+        palette = np.zeros((1 << bits, 3), dtype=np.uint8)
+        palette[:len(colors), 0] = (colors >> 16) & 0xff
+        palette[:len(colors), 1] = (colors >> 8) & 0xff
+        palette[:len(colors), 2] = colors & 0xff
+
+        min_code_size = max(2, bits)
+        data = _lzw_encode(indices.astype(np.uint8).tobytes(), min_code_size)
+
+        # Disposal method 1: the frame stays on the canvas and the next region is drawn over it
+        flags = 1 << 2 | has_transparency
+        transparent = len(colors) - 1 if has_transparency else 0
+        self.file.write(b'\x21\xf9\x04' + struct.pack('<BHBB', flags, self.delay, transparent, 0))
+        self.file.write(b'\x2c' + struct.pack('<HHHHB', left, top, right - left, bottom - top, 0x80 | (bits - 1)))
+        self.file.write(palette.tobytes())
+        self.file.write(bytes([min_code_size]))
+        for i in range(0, len(data), 255):
+            block = data[i:i + 255]
+            self.file.write(bytes([len(block)]) + block)
+        self.file.write(b'\x00')
+
+    def close(self):
+        self.file.write(b'\x3b')
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Recorder:
+    """
+    Runs games headlessly and renders every tick, either as a PNG sequence (when path is a directory)
+    or as one animated GIF per game (when path ends with .gif).
+    """
+
+    UNIT_SIZE = 16
+    FRAME_RATE = 10.0
+
+    def __init__(self, game: Game, path: str, frame_rate: float):
+        self.game = game
+        self.path = path
+        self.frame_rate = frame_rate if frame_rate > 0 else Recorder.FRAME_RATE
+        self.graphics = OffscreenGraphics(
+            1.0 / self.frame_rate,
+            Recorder.UNIT_SIZE,
+            (self.game.map.width, self.game.map.height)
+        )
+        self.graphics.draw_map(self.game.map.walls)
+        self.n_games = 0
+
+    def reset(self):
+        self.game.reset()
+
+    def run(self):
+        root, extension = os.path.splitext(self.path)
+        if extension.lower() == '.gif':
+            with GifWriter(f'{root}-{self.n_games:04d}{extension}', 1.0 / self.frame_rate) as writer:
+                self._run(writer.write)
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            frames = itertools.count()
+            self._run(lambda frame: save_png(
+                frame, os.path.join(self.path, f'{self.n_games:04d}-{next(frames):06d}.png')))
+
+        self.n_games += 1
+
+    # MARK: Private
+
+    def _run(self, write):
+        write(self.graphics.render(self.game))
+        while self.game.is_running():
+            self.game.update()
+            write(self.graphics.render(self.game))
+
+
+# MARK: Helper functions
+
+@functools.lru_cache(maxsize=None)
+def parse_color(color: str) -> (int, int, int):
+    if color.startswith('#'):
+        digits = color[1:]
+        if len(digits) == 3:
+            digits = ''.join(d * 2 for d in digits)
+        return int(digits[0:2], 16), int(digits[2:4], 16), int(digits[4:6], 16)
+
+    if color.lower() not in COLORS:
+        raise ValueError(f'unknown color {color!r}')
+    return COLORS[color.lower()]
+
+
+def save_png(frame: np.ndarray, path: str):
+    height, width = frame.shape[:2]
+    rows = np.zeros((height, 1 + width * 3), dtype=np.uint8)  # filter type 0 on every row
+    rows[:, 1:] = frame.reshape(height, width * 3)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        f.write(chunk(b'IEND', b''))
+
+
+def _get_changed_box(previous: np.ndarray, frame: np.ndarray) -> (int, int, int, int):
+    """
+    Returns left, top, right and bottom of the pixels that differ between the frames, the whole frame if there is
+    no previous one, and a single pixel if nothing changed since every GIF frame needs an image.
+    """
+    height, width = frame.shape[:2]
+    if previous is None:
+        return 0, 0, width, height
+
+    changed = np.any(previous != frame, axis=2)
+    rows, columns = np.flatnonzero(changed.any(axis=1)), np.flatnonzero(changed.any(axis=0))
+    if len(rows) == 0:
+        return 0, 0, 1, 1
+    return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+
+def _smooth_polygon(points: [(float, float)], iterations=2) -> [(float, float)]:
+    # Chaikin corner cutting converges to the quadratic B-spline Tk uses for smooth polygons
+    for _ in range(iterations):
+        smoothed = []
+        for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]):
+            smoothed.append((0.75 * x0 + 0.25 * x1, 0.75 * y0 + 0.25 * y1))
+            smoothed.append((0.25 * x0 + 0.75 * x1, 0.25 * y0 + 0.75 * y1))
+        points = smoothed
+    return points
+
+
+def _polygon_mask(points: [(float, float)], px: np.ndarray, py: np.ndarray) -> np.ndarray:
+    # Even-odd rule evaluated at pixel centers
+    mask = np.zeros((py.shape[0], px.shape[1]), dtype=bool)
+    for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]):
+        if y0 == y1:
+            continue
+        crosses = (py >= min(y0, y1)) & (py < max(y0, y1))
+        mask ^= crosses & (px < x0 + (py - y0) * (x1 - x0) / (y1 - y0))
+    return mask
+
+
+def _lzw_encode(data: bytes, min_code_size: int) -> bytes:
+    clear_code = 1 << min_code_size
+    code_size = min_code_size + 1
+    next_code = clear_code + 2
+    table = {}
+    # Codes of the strings of 2, 3, ... copies of each byte, so runs of one color skip their table lookups
+    run_codes = {}
+    run_lengths = {}  # code of a run: (byte, copies)
+
+    output = bytearray()
+    buffer, n_bits = clear_code, code_size
+
+    values = np.frombuffer(data, dtype=np.uint8)
+    starts = np.flatnonzero(values[1:] != values[:-1]) + 1
+    lengths = np.diff(np.concatenate(([0], starts, [len(values)])))
+    lengths[0] -= 1  # the first byte is the initial prefix
+
+    prefix = data[0]
+    for byte, length in zip(values[np.concatenate(([0], starts))].tolist(), lengths.tolist()):
+        while length > 0:
+            run = run_lengths.get(prefix)
+            copies = 1 if prefix == byte else run[1] if run is not None and run[0] == byte else 0
+            if copies:
+                codes = run_codes.get(byte, [])
+                skip = min(length, len(codes) + 1 - copies)
+                if skip > 0:
+                    copies += skip
+                    length -= skip
+                    prefix = codes[copies - 2]
+                    if length == 0:
+                        break
+
+            key = (prefix << 8) | byte
+            code = table.get(key)
+            if code is not None:
+                prefix = code
+                length -= 1
+                continue
+
+            buffer |= prefix << n_bits
+            n_bits += code_size
+            while n_bits >= 8:
+                output.append(buffer & 0xff)
+                buffer >>= 8
+                n_bits -= 8
+
+            if next_code < 4096:
+                table[key] = next_code
+                if copies:
+                    run_codes.setdefault(byte, []).append(next_code)
+                    run_lengths[next_code] = byte, copies + 1
+                next_code += 1
+                if next_code > (1 << code_size) and code_size < 12:
+                    code_size += 1
+            else:
+                buffer |= clear_code << n_bits
+                n_bits += code_size
+                table.clear()
+                run_codes.clear()
+                run_lengths.clear()
+                code_size = min_code_size + 1
+                next_code = clear_code + 2
+
+            prefix = byte
+            length -= 1
+
+    for code in [prefix, clear_code + 1]:
+        buffer |= code << n_bits
+        n_bits += code_size
+        # The decoder adds its last entry when reading the final prefix, which can widen the end code
+        if next_code >= (1 << code_size) and code_size < 12:
+            code_size += 1
+
+    while n_bits > 0:
+        output.append(buffer & 0xff)
+        buffer >>= 8
+        n_bits -= 8
+
+    return bytes(output)
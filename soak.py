@@ -0,0 +1,196 @@
+import gc
+import os
+import sys
+import time
+import tracemalloc
+import agent
+from cli import SoakConfiguration
+from game import Game
+
+__all__ = ['SoakMonitor', 'run_soak_test']
+
+MB = 1024.0 * 1024.0
+
+
+class Sample:
+    def __init__(self, n_games: int, traced: int, rss: int, collections: int, objects: int, agent_ids: int,
+                 tick_latency: float):
+        self.n_games = n_games
+        self.traced = traced
+        self.rss = rss
+        self.collections = collections
+        self.objects = objects
+        self.agent_ids = agent_ids
+        self.tick_latency = tick_latency
+
+
+class SoakMonitor:
+    """
+    Samples traced memory, RSS, garbage collections and tick latency every few games,
+    and checks their drift against the thresholds of the soak configuration.
+    The first sample is the baseline, so everything allocated while warming up is not counted as growth.
+    Latency drift is taken from the least squares trend of all samples, since single windows vary a lot.
+    """
+
+    TOP_ALLOCATIONS = 10
+
+    def __init__(self, config: SoakConfiguration):
+        self.config = config
+        self.samples = []
+        self.n_games = 0
+        self._window_games = 0
+        self._window_ticks = 0
+        self._window_time = 0.0
+        self._baseline_snapshot = None
+        tracemalloc.start()
+
+    def add_game(self, ticks: int, elapsed: float):
+        self.n_games += 1
+        self._window_games += 1
+        self._window_ticks += ticks
+        self._window_time += elapsed
+        if self.n_games % self.config.interval == 0:
+            self.sample()
+
+    def sample(self):
+        # memory is read before anything is allocated for the sample itself
+        traced, rss = tracemalloc.get_traced_memory()[0], _get_rss()
+        if self._baseline_snapshot is None:
+            _take_snapshot()  # filtering compiles and caches the filename patterns on first use
+            self._baseline_snapshot = _take_snapshot()
+
+        sample = Sample(
+            self.n_games,
+            traced,
+            rss,
+            sum(stats['collections'] for stats in gc.get_stats()),
+            len(gc.get_objects()),
+            agent._agent_id,
+            self._window_time / max(1, self._window_ticks)
+        )
+        self.samples.append(sample)
+        self._window_games = 0
+        self._window_ticks = 0
+        self._window_time = 0.0
+
+        print(f'games: {sample.n_games:>8}  '
+              f'traced: {sample.traced / MB:8.2f} MB  '
+              f'rss: {sample.rss / MB:8.2f} MB  '
+              f'gc collections: {sample.collections:>8}  '
+              f'objects: {sample.objects:>9}  '
+              f'tick: {sample.tick_latency * 1e6:8.2f} us', flush=True)
+
+    def finish(self) -> bool:
+        """
+        Prints the trends and the top allocation sites since the baseline and returns whether the soak test passed.
+        """
+        # a final window of less than half the interval is too short for a reliable tick latency
+        if not self.samples or 2 * self._window_games >= self.config.interval:
+            self.sample()
+
+        first, last = self.samples[0], self.samples[-1]
+        memory_growth = (last.traced - first.traced) / MB
+        first_latency, last_latency = _get_trend_line(self.samples, 'tick_latency', first.n_games, last.n_games)
+        latency_drift = last_latency / first_latency - 1.0 if first_latency > 0 else 0.0
+
+        print(f'\nsoak test over {self.n_games} games, {len(self.samples)} samples')
+        print(f'traced memory: {memory_growth:+.2f} MB '
+              f'({_get_slope(self.samples, "traced") / MB * 1000:+.3f} MB per 1000 games)')
+        print(f'rss: {(last.rss - first.rss) / MB:+.2f} MB '
+              f'({_get_slope(self.samples, "rss") / MB * 1000:+.3f} MB per 1000 games)')
+        print(f'live objects: {last.objects - first.objects:+d} '
+              f'({_get_slope(self.samples, "objects") * 1000:+.1f} per 1000 games)')
+        print(f'gc collections: {last.collections - first.collections}')
+        print(f'agent ids: {last.agent_ids - first.agent_ids:+d}')
+        print(f'tick latency trend: {first_latency * 1e6:.2f} us -> {last_latency * 1e6:.2f} us '
+              f'({latency_drift:+.1%}, samples {first.tick_latency * 1e6:.2f} us -> {last.tick_latency * 1e6:.2f} us)')
+
+        print(f'\ntop allocation sites since games: {first.n_games}')
+        for stat in _take_snapshot().compare_to(self._baseline_snapshot, 'lineno')[:SoakMonitor.TOP_ALLOCATIONS]:
+            print(f'  {stat}')
+        tracemalloc.stop()
+
+        failures = []
+        if 0 < self.config.max_memory_growth < memory_growth:
+            failures.append(f'traced memory grew by {memory_growth:.2f} MB (limit {self.config.max_memory_growth} MB)')
+        if 0 < self.config.max_latency_drift < latency_drift:
+            failures.append(f'tick latency drifted by {latency_drift:.1%} (limit {self.config.max_latency_drift:.1%})')
+
+        for failure in failures:
+            print(f'FAILED: {failure}')
+        if not failures:
+            print('PASSED')
+        return not failures
+
+
+def run_soak_test(app, game: Game, n_games: int, config: SoakConfiguration) -> int:
+    """
+    Runs the games like main.py does while monitoring them, and returns the exit status.
+    """
+    monitor = SoakMonitor(config)
+    for _ in range(n_games):
+        start = time.perf_counter()
+        app.run()
+        monitor.add_game(game.tick, time.perf_counter() - start)
+        app.reset()
+
+    return 0 if monitor.finish() else 1
+
+
+# MARK: Helper functions
+
+def _take_snapshot() -> tracemalloc.Snapshot:
+    """
+    Snapshot of the allocations of the game and the agents, without those of the monitor itself.
+    """
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ])
+
+
+def _get_rss() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return 0
+
+    # peak rather than current RSS, reported in bytes on macOS and in kilobytes elsewhere
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def _get_slope(samples: [Sample], attribute: str) -> float:
+    """
+    Least squares slope of an attribute per game.
+    """
+    return _get_fit(samples, attribute)[1]
+
+
+def _get_trend_line(samples: [Sample], attribute: str, *n_games: int) -> [float]:
+    """
+    Values of the least squares line of an attribute after each of n_games games.
+    """
+    mean, slope = _get_fit(samples, attribute)
+    mean_x = sum(s.n_games for s in samples) / len(samples)
+    return [mean + slope * (x - mean_x) for x in n_games]
+
+
+def _get_fit(samples: [Sample], attribute: str) -> (float, float):
+    """
+    Mean and least squares slope per game of an attribute.
+    """
+    ys = [getattr(s, attribute) for s in samples]
+    mean_y = sum(ys) / len(ys)
+    if len(samples) < 2:
+        return mean_y, 0.0
+
+    xs = [s.n_games for s in samples]
+    mean_x = sum(xs) / len(xs)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    return mean_y, sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
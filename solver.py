@@ -0,0 +1,504 @@
+import heapq
+import mmap
+import os
+import shutil
+import tempfile
+from typing import Type
+
+from agent import Agent, StaticAgent
+from game import Direction, Flags, Game
+
+__all__ = ['Solution', 'PackedStateSet', 'solve', 'replay']
+
+
+DIRECTION_NAMES = {
+    Direction.North: 'North',
+    Direction.South: 'South',
+    Direction.East: 'East',
+    Direction.West: 'West',
+    Direction.Stop: 'Stop',
+}
+
+
+class Solution:
+    def __init__(self, score: int, actions: [int], n_states: int, verified: bool, is_complete: bool):
+        self.score = score
+        self.actions = actions
+        self.n_states = n_states
+        self.verified = verified
+        self.is_complete = is_complete  # False if games longer than max_depth might score more
+
+    def __str__(self):
+        title = 'optimal score' if self.is_complete else 'best score within the depth limit (longer games not searched)'
+        return \
+            f'{title}: {self.score} in {len(self.actions)} moves ({self.n_states} states visited, ' \
+            f'replay {"matches" if self.verified else "DOES NOT match"})\n' + \
+            ' '.join(DIRECTION_NAMES[a] for a in self.actions)
+
+
+class StateEncoding:
+    """
+    Packs a game state into one integer, from the least significant bit up: pacman square, pacman direction,
+    then alive bit, square and direction of every ghost, then one bit per phantom and one bit per food.
+    Squares are indices of the squares that are not walls. Directions are only stored when ghosts can move,
+    since otherwise they cannot influence the rest of the game.
+    Phantoms are the starting squares of ghosts left out by n_ghosts: the map still marks them as ghosts,
+    so they block other ghosts and pacman scores for eating them like a ghost.
+    """
+
+    def __init__(self, game: Game, with_directions: bool):
+        game_map = game.map
+        self.squares = [(x, y) for y in range(game_map.height) for x in range(game_map.width) if not game_map.walls[y][x]]
+        self.square_index = {square: i for i, square in enumerate(self.squares)}
+        self.food_squares = [(x, y) for x, y in self.squares if game_map.initial_food[y][x]]
+        self.phantom_squares = game_map.ghost_initial_positions[len(game.ghosts):]
+        self.n_ghosts = len(game.ghosts)
+
+        self.square_bits = max(1, (len(self.squares) - 1).bit_length())
+        self.direction_bits = 3 if with_directions else 0
+        self.ghost_bits = 1 + self.square_bits + self.direction_bits
+        self.phantom_shift = self.square_bits + self.direction_bits + self.n_ghosts * self.ghost_bits
+        self.food_shift = self.phantom_shift + len(self.phantom_squares)
+        self.n_bits = self.food_shift + len(self.food_squares)
+
+        self.alive_mask = 0
+        for i in range(self.n_ghosts):
+            self.alive_mask |= 1 << self._get_ghost_shift(i)
+
+    def encode(self,
+               pacman: ((int, int), int),
+               ghosts: [(bool, (int, int), int)],
+               phantoms: int,
+               food: int) -> int:
+
+        (position, direction) = pacman
+        state = self.square_index[position] | (direction if self.direction_bits else 0) << self.square_bits
+        for i, (alive, position, direction) in enumerate(ghosts):
+            if alive:
+                ghost = 1 | self.square_index[position] << 1 | (direction if self.direction_bits else 0) << (1 + self.square_bits)
+                state |= ghost << self._get_ghost_shift(i)
+        return state | phantoms << self.phantom_shift | food << self.food_shift
+
+    def decode(self, state: int) -> (((int, int), int), [(bool, (int, int), int)], int, int):
+        square_mask, direction_mask = (1 << self.square_bits) - 1, (1 << self.direction_bits) - 1
+        pacman = self.squares[state & square_mask], (state >> self.square_bits) & direction_mask or Direction.Stop
+
+        ghosts = []
+        for i in range(self.n_ghosts):
+            ghost = state >> self._get_ghost_shift(i)
+            if ghost & 1:
+                ghosts.append((True, self.squares[(ghost >> 1) & square_mask],
+                               (ghost >> (1 + self.square_bits)) & direction_mask or Direction.Stop))
+            else:
+                ghosts.append((False, (-1000, -1000), Direction.Stop))
+
+        phantoms = (state >> self.phantom_shift) & ((1 << len(self.phantom_squares)) - 1)
+        return pacman, ghosts, phantoms, state >> self.food_shift
+
+    def encode_game(self, game: Game) -> int:
+        ghost_squares = [g.position for g in game.ghosts if g.alive]
+        phantoms = 0
+        for i, square in enumerate(self.phantom_squares):
+            phantoms |= (game.map.is_at(Flags.Ghost, *square) and square not in ghost_squares) << i
+
+        food = 0
+        for i, (x, y) in enumerate(self.food_squares):
+            food |= game.map.food[y][x] << i
+
+        return self.encode(
+            (game.pacman.position, game.pacman.direction),
+            [(g.alive, g.position, g.direction) for g in game.ghosts],
+            phantoms,
+            food
+        )
+
+    def count_eaten(self, state: int) -> (int, int):
+        """
+        Returns the number of food and ghosts, phantoms included, eaten.
+        """
+        ghosts_and_phantoms = state & (self.alive_mask | ((1 << len(self.phantom_squares)) - 1) << self.phantom_shift)
+        return \
+            len(self.food_squares) - bin(state >> self.food_shift).count('1'), \
+            self.n_ghosts + len(self.phantom_squares) - bin(ghosts_and_phantoms).count('1')
+
+    # MARK: Private
+
+    def _get_ghost_shift(self, i: int) -> int:
+        return self.square_bits + self.direction_bits + i * self.ghost_bits
+
+
+class PackedStateSet:
+    """
+    Set of packed states stored as fixed-width big-endian records in an open addressing table.
+    Once the table holds max_states states they are written as a sorted run to disk and the table is emptied;
+    membership is then also checked with a binary search in every run. Runs are merged when there are too many.
+    """
+
+    MAX_RUNS = 8
+
+    def __init__(self, n_bits: int, max_states=1 << 22, directory: str = None):
+        # one more bit so that state + 1 fits, an all zero record marks an empty slot
+        self.width = (n_bits + 1 + 7) // 8
+        self.max_states = max_states
+        self.directory = directory
+        self.n_states = 0
+        self._capacity = 1 << 10
+        self._slots = bytearray(self._capacity * self.width)
+        self._count = 0
+        self._runs = []
+        self._empty = bytes(self.width)
+
+    def __len__(self):
+        return self.n_states
+
+    def add(self, state: int) -> bool:
+        """
+        Adds a state and returns whether it was not in the set yet.
+        """
+        record = (state + 1).to_bytes(self.width, 'big')
+        index = self._find_slot(record)
+        if self._slots[index:index + self.width] == record or self._is_in_runs(record):
+            return False
+
+        self._slots[index:index + self.width] = record
+        self._count += 1
+        self.n_states += 1
+        if self._count * 2 > self._capacity:
+            if self._count >= self.max_states:
+                self._spill()
+            else:
+                self._resize(self._capacity * 2)
+        return True
+
+    def close(self):
+        for run in self._runs:
+            run.close()
+        self._runs.clear()
+
+    # MARK: Private
+
+    def _find_slot(self, record: bytes) -> int:
+        mask = self._capacity - 1
+        i = (hash(record) * 0x9E3779B97F4A7C15 >> 32) & mask
+        while True:
+            slot = self._slots[i * self.width:(i + 1) * self.width]
+            if slot == record or slot == self._empty:
+                return i * self.width
+            i = (i + 1) & mask
+
+    def _resize(self, capacity: int):
+        records = list(self._iterate_table())
+        self._capacity = capacity
+        self._slots = bytearray(capacity * self.width)
+        for record in records:
+            index = self._find_slot(record)
+            self._slots[index:index + self.width] = record
+
+    def _iterate_table(self):
+        for i in range(0, len(self._slots), self.width):
+            record = bytes(self._slots[i:i + self.width])
+            if record != self._empty:
+                yield record
+
+    def _is_in_runs(self, record: bytes) -> bool:
+        return any(run.contains(record) for run in self._runs)
+
+    def _spill(self):
+        self._runs.append(_Run(self.width, sorted(self._iterate_table()), self._get_directory()))
+        if len(self._runs) > PackedStateSet.MAX_RUNS:
+            merged = _Run(self.width, heapq.merge(*[iter(run) for run in self._runs]), self._get_directory())
+            self.close()
+            self._runs.append(merged)
+
+        self._capacity = 1 << 10
+        self._slots = bytearray(self._capacity * self.width)
+        self._count = 0
+
+    def _get_directory(self) -> str:
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='pacman-solver-')
+        return self.directory
+
+
+class _Run:
+    """
+    Sorted records in a file on disk, searched through a memory map.
+    """
+
+    def __init__(self, width: int, records, directory: str):
+        self.width = width
+        fd, self.path = tempfile.mkstemp(suffix='.run', dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            for record in records:
+                f.write(record)
+
+        self.length = os.path.getsize(self.path) // width
+        self._map = None
+        if self.length:
+            # the memory map stays valid once the file is closed
+            with open(self.path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield self._map[i * self.width:(i + 1) * self.width]
+
+    def contains(self, record: bytes) -> bool:
+        low, high = 0, self.length
+        while low < high:
+            middle = (low + high) // 2
+            if self._map[middle * self.width:(middle + 1) * self.width] < record:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self.length and self._map[low * self.width:(low + 1) * self.width] == record
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        os.remove(self.path)
+
+
+class _Layer:
+    """
+    States discovered at one depth of the search, appended to a file and read back in order once finished.
+    """
+
+    def __init__(self, width: int, directory: str):
+        self.width = width
+        fd, self.path = tempfile.mkstemp(suffix='.layer', dir=directory)
+        self._file = os.fdopen(fd, 'wb')
+        self.length = 0
+
+    def append(self, state: int):
+        self._file.write(state.to_bytes(self.width, 'big'))
+        self.length += 1
+
+    def finish(self):
+        # every depth keeps its layer for the backtracking, so none may hold on to a file descriptor
+        self._file.close()
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(self.width * 4096)
+                if not chunk:
+                    break
+                for i in range(0, len(chunk), self.width):
+                    yield int.from_bytes(chunk[i:i + self.width], 'big')
+
+    def close(self):
+        self._file.close()
+        os.remove(self.path)
+
+
+class _ScriptedAgent(Agent):
+    def initialize(self):
+        self.actions = []
+
+    def choose_action(self, game: Game) -> int:
+        return self.actions.pop(0) if self.actions else Direction.Stop
+
+
+class _StaticGhostModel:
+    """
+    Transitions for ghosts that never move: only pacman changes square, eating the food and ghosts on it.
+    """
+
+    def __init__(self, encoding: StateEncoding):
+        self.encoding = encoding
+        food_bits = {square: 1 << i for i, square in enumerate(encoding.food_squares)}
+        phantom_bits = {square: 1 << i for i, square in enumerate(encoding.phantom_squares)}
+        self._moves = []
+        for x, y in encoding.squares:
+            moves = []
+            for direction in range(1, 5):
+                offset = Game.Moves[direction]
+                destination = x + offset[0], y + offset[1]
+                if destination in encoding.square_index:
+                    moves.append((direction, destination, phantom_bits.get(destination, 0), food_bits.get(destination, 0)))
+            self._moves.append(moves)
+
+    def get_successors(self, state: int) -> [(int, int)]:
+        encoding = self.encoding
+        (position, direction), ghosts, phantoms, food = encoding.decode(state)
+        successors = []
+        for action, destination, phantom_bit, food_bit in self._moves[encoding.square_index[position]]:
+            successors.append((action, encoding.encode(
+                (destination, action),
+                [(alive and square != destination, square, d) for alive, square, d in ghosts],
+                phantoms & ~phantom_bit,
+                food & ~food_bit
+            )))
+        return successors
+
+
+class _GameModel:
+    """
+    Transitions computed by loading the state into a Game and calling Game.update, for ghosts whose choice of action
+    only depends on the game state. Ghosts that keep state of their own between ticks are not supported.
+    """
+
+    def __init__(self, encoding: StateEncoding, game: Game):
+        self.encoding = encoding
+        self.game = game
+
+    def get_successors(self, state: int) -> [(int, int)]:
+        successors = []
+        for action in range(1, 6):
+            self._load(state)
+            self.game.pacman.actions = [action]
+            self.game.update()
+            successors.append((action, self.encoding.encode_game(self.game)))
+        return successors
+
+    # MARK: Private
+
+    def _load(self, state: int):
+        game, game_map = self.game, self.game.map
+        (position, direction), ghosts, phantoms, food = self.encoding.decode(state)
+
+        game_map.remove(Flags.Pacman, *game.pacman.position)
+        for ghost in game.ghosts:
+            if ghost.alive:
+                game_map.remove(Flags.Ghost, *ghost.position)
+        for i, square in enumerate(self.encoding.phantom_squares):
+            (game_map.add if (phantoms >> i) & 1 else game_map.remove)(Flags.Ghost, *square)
+
+        game.pacman.position = game.pacman.previous_position = position
+        game.pacman.direction = direction
+        game_map.add(Flags.Pacman, *position)
+        for ghost, (alive, position, direction) in zip(game.ghosts, ghosts):
+            ghost.alive = alive
+            ghost.position = ghost.previous_position = position
+            ghost.direction = direction
+            if alive:
+                game_map.add(Flags.Ghost, *position)
+
+        for i, (x, y) in enumerate(self.encoding.food_squares):
+            if (food >> i) & 1 != game_map.food[y][x]:
+                (game_map.add if (food >> i) & 1 else game_map.remove)(Flags.Food, x, y)
+
+        game.score = 0
+        game.ghost_distance_field.reset([g.position for g in game.ghosts if g.alive])
+        game.pacman_distance_field.reset([game.pacman.position])
+
+
+def solve(layout: [str],
+          ghost: Type[Agent],
+          n_ghosts: int,
+          max_depth=1000,
+          max_states_in_memory=1 << 22,
+          directory: str = None) -> Solution:
+    """
+    Finds the highest score pacman can reach against deterministic ghosts with a breadth-first search over all
+    reachable states. Every move costs the same, so the first time a state is reached is also its best score;
+    states that cannot beat the best finished game any more are not expanded. Returns None if no game finishes
+    within max_depth moves, and raises ValueError for ghosts whose moves are not deterministic.
+    """
+    game = Game(layout, _ScriptedAgent, ghost, n_ghosts)
+    if not game.is_running():
+        return Solution(0, [], 1, True, True)
+
+    is_static = ghost.choose_action is StaticAgent.choose_action
+    encoding = StateEncoding(game, with_directions=not is_static)
+    model = _StaticGhostModel(encoding) if is_static else _GameModel(encoding, game)
+    start = encoding.encode_game(game)
+    if not is_static and not _is_deterministic(model, start):
+        raise ValueError(f'{ghost.__name__} does not move deterministically, the optimal score cannot be searched')
+
+    directory = tempfile.mkdtemp(prefix='pacman-solver-', dir=directory)
+    visited = PackedStateSet(encoding.n_bits, max_states_in_memory, directory)
+    layers = [_Layer(visited.width, directory)]
+
+    def get_score(state: int, depth: int) -> int:
+        food, ghosts = encoding.count_eaten(state)
+        return food * Game.SCORE_PER_FOOD + ghosts * Game.SCORE_PER_GHOST - depth
+
+    def get_upper_bound(state: int, depth: int) -> int:
+        # every food left at most adds its score. Static ghosts each take at least one more move to eat,
+        # moving ones do not: one can walk into pacman in the same tick pacman eats another
+        food, ghosts = encoding.count_eaten(state)
+        ghosts_left = encoding.n_ghosts + len(encoding.phantom_squares) - ghosts
+        return get_score(state, depth) + (len(encoding.food_squares) - food) * Game.SCORE_PER_FOOD \
+            + ghosts_left * (Game.SCORE_PER_GHOST - is_static)
+
+    try:
+        visited.add(start)
+        layers[0].append(start)
+        layers[0].finish()
+        best = None, None, None  # score, state, depth
+
+        for depth in range(max_depth):
+            layer = _Layer(visited.width, directory)
+            for state in layers[depth]:
+                if best[0] is not None and get_upper_bound(state, depth) <= best[0]:
+                    continue
+                for _, successor in model.get_successors(state):
+                    if not visited.add(successor):
+                        continue
+                    if successor & encoding.alive_mask == 0:
+                        score = get_score(successor, depth + 1)
+                        if best[0] is None or score > best[0]:
+                            best = score, successor, depth + 1
+                    else:
+                        layer.append(successor)
+            layer.finish()
+            layers.append(layer)
+            if layer.length == 0:
+                break
+
+        score, state, depth = best
+        if score is None:
+            return None
+
+        # states left unexpanded at the depth limit could still lead to a better game
+        is_complete = all(get_upper_bound(s, len(layers) - 1) <= score for s in layers[-1])
+
+        actions = []
+        for previous in range(depth - 1, -1, -1):
+            predecessor = next(((s, a) for s in layers[previous] for a, successor in model.get_successors(s)
+                                if successor == state), None)
+            if predecessor is None:
+                raise RuntimeError(f'no predecessor found for the state at depth {previous + 1}, '
+                                   f'{ghost.__name__} did not move the same way twice')
+            state, action = predecessor
+            actions.append(action)
+        actions.reverse()
+
+        replayed_score, is_running = replay(layout, ghost, n_ghosts, actions)
+        return Solution(score, actions, len(visited), replayed_score == score and not is_running, is_complete)
+
+    finally:
+        visited.close()
+        for layer in layers:
+            layer.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def replay(layout: [str], ghost: Type[Agent], n_ghosts: int, actions: [int]) -> (int, bool):
+    """
+    Plays the pacman actions in a new game and returns the score and whether the game is still running.
+    """
+    game = Game(layout, _ScriptedAgent, ghost, n_ghosts)
+    game.pacman.actions = list(actions)
+    for _ in actions:
+        if not game.is_running():
+            break
+        game.update()
+    return game.score, game.is_running()
+
+
+# MARK: Helper functions
+
+def _is_deterministic(model: _GameModel, start: int, n_tries=3) -> bool:
+    """
+    Whether the successors of the start state and of its successors are the same every time they are computed.
+    Random ghosts can repeat a move by chance, so this is checked a few times.
+    """
+    successors = model.get_successors(start)
+    states = [start] + [successor for _, successor in successors]
+    for _ in range(n_tries):
+        if any(model.get_successors(state) != model.get_successors(state) for state in states):
+            return False
+    return True
@@ -0,0 +1,158 @@
+import sys
+import time
+from typing import Type
+
+from agent import Agent
+from game import Direction, Game
+
+__all__ = ['TextGraphics', 'TextApplication']
+
+
+ESCAPE = '\x1b['
+
+STYLES = {
+    'wall': ESCAPE + '0;47m',
+    'space': ESCAPE + '0m',
+    'food': ESCAPE + '0;97m',
+    'pacman': ESCAPE + '0;1;93m',
+    'red': ESCAPE + '0;1;91m',
+    'green': ESCAPE + '0;1;92m',
+    'blue': ESCAPE + '0;1;94m',
+    'orange': ESCAPE + '0;1;38;5;208m',
+    None: ESCAPE + '0;1;97m',  # ghosts beyond the fourth have no color
+}
+
+PACMAN_CHARACTERS = {
+    Direction.North: 'V',
+    Direction.South: '^',
+    Direction.East: '<',
+    Direction.West: '>',
+    Direction.Stop: 'C',
+}
+
+
+class TextGraphics:
+    """
+    Draws the game in a terminal with ANSI escape codes. After the first frame only the squares changed since the
+    previous frame are drawn; they are collected by observing the map. Every frame is written to the output at once.
+    """
+
+    def __init__(self, game: Game, zoom=1.0, frame_skip=0, output=sys.stdout):
+        self.game = game
+        self.square_width = max(1, int(round(2 * zoom)))
+        self.frame_skip = max(0, frame_skip)
+        self.output = output
+        self._changed = set()
+        self._redraw = True
+        self._status = None
+        self._n_frames = 0
+        game.map.observers.append(self._mark_changed)
+
+    def reset(self):
+        self._redraw = True
+
+    def draw(self, force=False) -> bool:
+        """
+        Draws a frame unless it is skipped, and returns whether it was drawn.
+        """
+        self._n_frames += 1
+        if not force and (self._n_frames - 1) % (self.frame_skip + 1) != 0:
+            return False
+
+        game = self.game
+        parts = [ESCAPE + '?25l']  # hide the cursor
+        if self._redraw:
+            parts.append(ESCAPE + '2J')
+            squares = [(x, y) for y in range(game.map.height) for x in range(game.map.width)]
+            self._redraw = False
+            self._status = None
+        else:
+            squares = [(x, y) for x, y in self._changed if 0 <= x < game.map.width and 0 <= y < game.map.height]
+        self._changed.clear()
+
+        ghosts = {g.position: g for g in game.ghosts if g.alive}
+        style, cursor = None, None
+        # top to bottom and left to right, so that neighbouring squares need no cursor movement
+        for x, y in sorted(squares, key=lambda s: (-s[1], s[0])):
+            row, column = game.map.height - y, x * self.square_width + 1
+            if cursor != (row, column):
+                parts.append(f'{ESCAPE}{row};{column}H')
+
+            square_style, text = self._get_square(x, y, ghosts)
+            if square_style != style:
+                parts.append(square_style)
+                style = square_style
+            parts.append(text)
+            cursor = row, column + self.square_width
+
+        status = self._get_status()
+        if status != self._status:
+            parts.append(f'{ESCAPE}{game.map.height + 2};1H{ESCAPE}0m{ESCAPE}2K{status}')
+            self._status = status
+
+        parts.append(f'{ESCAPE}0m{ESCAPE}{game.map.height + 3};1H{ESCAPE}?25h')
+        self.output.write(''.join(parts))
+        self.output.flush()
+        return True
+
+    # MARK: Private
+
+    def _mark_changed(self, x: int, y: int):
+        self._changed.add((x, y))
+
+    def _get_square(self, x: int, y: int, ghosts: {(int, int): Agent}) -> (str, str):
+        game = self.game
+        if game.pacman.position == (x, y):
+            style, character = STYLES['pacman'], PACMAN_CHARACTERS[game.pacman.direction]
+        elif (x, y) in ghosts:
+            style, character = STYLES.get(ghosts[(x, y)].color, STYLES[None]), 'M'
+        elif game.map.walls[y][x]:
+            style, character = STYLES['wall'], ' '
+        elif game.map.food[y][x]:
+            style, character = STYLES['food'], '.'
+        else:
+            style, character = STYLES['space'], ' '
+        return style, character.center(self.square_width)
+
+    def _get_status(self) -> str:
+        game = self.game
+        distances = []
+        for ghost in game.ghosts:
+            distance = abs(ghost.position[0] - game.pacman.position[0]) + abs(ghost.position[1] - game.pacman.position[1])
+            distances.append(f'{STYLES.get(ghost.color, STYLES[None])}{distance if ghost.alive else -1}{ESCAPE}0m')
+        return f'Score: {game.score}  ' + ' '.join(distances)
+
+
+class TextApplication:
+
+    def __init__(self,
+                 layout: [str],
+                 pacman: Type[Agent],
+                 ghost: Type[Agent],
+                 n_ghosts: int,
+                 frame_rate: float,
+                 zoom=1.0,
+                 frame_skip=0):
+
+        self.game = Game(layout, pacman, ghost, n_ghosts)
+        self.graphics = TextGraphics(self.game, zoom, frame_skip)
+        self.frame_time = 0.0 if frame_rate == 0 else 1.0 / float(frame_rate)
+
+    def reset(self):
+        self.game.reset()
+        self.graphics.reset()
+
+    def run(self):
+        try:
+            self.graphics.draw(force=True)
+            previous_time = time.time()
+            while self.game.is_running():
+                self.game.update()
+                if self.graphics.draw():
+                    time.sleep(max(0.0, self.frame_time - (time.time() - previous_time)))
+                    previous_time = time.time()
+
+            self.graphics.draw(force=True)
+
+        except KeyboardInterrupt:
+            self.graphics.output.write(f'{ESCAPE}0m{ESCAPE}?25h\n')